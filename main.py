@@ -3,6 +3,7 @@
 Unified CLI for VPS SSH Wrapper.
 Usage:
   python main.py cmd [--timeout 300] "your command"
+  python main.py batch [-k] [commands.txt]
   python main.py shell
   python main.py put <local> <remote>
   python main.py get <remote> <local>
@@ -10,110 +11,92 @@ Or install: pip install -e .  # then `vps cmd "df -h"`
 """
 
 import argparse
+import logging
 import os
 import sys
-import select
-import signal
 import stat
-import struct
-import termios
-import tty
-from dotenv import load_dotenv
-from ssh_util import PersistentSSH
-
-load_dotenv()
-
-def get_ssh():
-    login = os.getenv('login')
-    password = os.getenv('password')
-    key_file = os.getenv('SSH_KEY_FILE')
-    if not login:
-        print("Error: 'login' (username@host) required in .env", file=sys.stderr)
-        sys.exit(1)
-    username, hostname = login.split('@', 1)
-    key_filename = f"./keys/{key_file}" if key_file else None
+import time
+
+# Redraw progress bars at most 10 times per second
+PROGRESS_INTERVAL = 0.1
+# Print plain progress lines at most every 5 seconds when stdout is not a terminal
+PROGRESS_LOG_INTERVAL = 5.0
+PROGRESS_BAR_LEN = 40
+# Every possible bar, so drawing one never allocates
+PROGRESS_BARS = [b'=' * i + b'-' * (PROGRESS_BAR_LEN - i) for i in range(PROGRESS_BAR_LEN + 1)]
+MB = 1024 * 1024
+# Loggers raised to INFO by -v: both SSH backends and the vps_cmd daemon
+VERBOSE_LOGGERS = ('ssh_util', 'ssh_util_async', 'vps_cmd_daemon')
+
+def get_ssh(backend=None):
+    # Imported here so --help and usage errors don't pay for loading
+    # paramiko or parsing .env
+    from vps_config import get_ssh_params
+
+    hostname, username, password, key_filename, port = get_ssh_params()
+    if (backend or os.getenv('SSH_BACKEND', 'paramiko')) == 'asyncssh':
+        from ssh_util_async import PersistentSSH
+    else:
+        from ssh_util import PersistentSSH
+
     ssh_conn = PersistentSSH(
         hostname=hostname,
         username=username,
         password=password,
-        key_filename=key_filename
+        key_filename=key_filename,
+        port=port
     )
     return ssh_conn
 
+def _write_result(result):
+    """Write a bytes execute() result to stdout/stderr"""
+    # Pass remote bytes through untouched instead of decoding and re-encoding
+    if result['output']:
+        sys.stdout.buffer.write(result['output'])
+        sys.stdout.flush()
+    if result['error']:
+        sys.stderr.buffer.write(result['error'])
+        sys.stderr.flush()
+
 def cmd(args):
-    ssh = get_ssh()
-    try:
+    with get_ssh() as ssh:
         command = ' '.join(args.command)
-        result = ssh.execute(command, timeout=args.timeout)
-        if result['output']:
-            print(result['output'], end='')
-        if result['error']:
-            print(result['error'], file=sys.stderr, end='')
-        sys.exit(result['exit_status'])
-    finally:
-        ssh.close()
-
-def _get_terminal_size():
-    """Get terminal dimensions (cols, rows)."""
-    try:
-        import fcntl
-        s = struct.pack('HHHH', 0, 0, 0, 0)
-        result = struct.unpack('HHHH',
-                               fcntl.ioctl(sys.stdout.fileno(),
-                                           termios.TIOCGWINSZ, s))
-        return result[1], result[0]  # cols, rows
-    except Exception:
-        return 80, 24
-
-
-def interactive_shell(ssh_conn):
-    """Open an interactive shell with full raw terminal support."""
-    cols, rows = _get_terminal_size()
-    term = os.environ.get('TERM', 'xterm-256color')
-    channel = ssh_conn.ssh.invoke_shell(term=term, width=cols, height=rows)
-
-    def sigwinch_handler(signum, frame):
-        c, r = _get_terminal_size()
-        try:
-            channel.resize_pty(width=c, height=r)
-        except Exception:
-            pass
-
-    old_settings = termios.tcgetattr(sys.stdin)
-    old_sigwinch = signal.getsignal(signal.SIGWINCH)
+        result = ssh.execute(command, timeout=args.timeout, decode=False)
+        _write_result(result)
+    sys.exit(result['exit_status'])
 
+def cmd_many(args):
+    """Handle 'vps batch': run one command per line over a single connection"""
     try:
-        tty.setraw(sys.stdin.fileno())
-        tty.setcbreak(sys.stdin.fileno())
-        channel.settimeout(0.0)
-        signal.signal(signal.SIGWINCH, sigwinch_handler)
-
-        while True:
-            r, w, e = select.select([channel, sys.stdin], [], [])
-
-            if channel in r:
-                try:
-                    data = channel.recv(4096)
-                    if len(data) == 0:
-                        break
-                    sys.stdout.buffer.write(data)
-                    sys.stdout.buffer.flush()
-                except Exception:
-                    break
-
-            if sys.stdin in r:
-                data = os.read(sys.stdin.fileno(), 1024)
-                if len(data) == 0:
+        if args.file == '-':
+            # Read stdin without closing it
+            lines = sys.stdin.readlines()
+        else:
+            with open(args.file) as source:
+                lines = source.readlines()
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    commands = [line.strip() for line in lines]
+    commands =[c for c in commands if c and not c.startswith('#')]
+
+    exit_status = 0
+    with get_ssh() as ssh:
+        for command in commands:
+            result = ssh.execute(command, timeout=args.timeout, decode=False)
+            _write_result(result)
+            if result['exit_status'] != 0:
+                print(f"Command failed ({result['exit_status']}): {command}", file=sys.stderr)
+                exit_status = exit_status or result['exit_status']
+                if not args.keep_going:
                     break
-                channel.send(data)
-
-    finally:
-        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-        signal.signal(signal.SIGWINCH, old_sigwinch)
-        channel.close()
+    sys.exit(exit_status)
 
 def shell(args):
-    ssh = get_ssh()
+    from vps_shell import interactive_shell
+
+    # The interactive shell drives a paramiko channel directly
+    ssh = get_ssh(backend='paramiko')
     try:
         interactive_shell(ssh)
     finally:
@@ -124,31 +107,56 @@ def shell(args):
 def create_progress_callback(description="Transferring"):
     """Create a progress callback for file transfers"""
     last_percent = [-1]
+    last_time = [0.0]
+    label = description.encode()
+    out = sys.stdout.buffer
+    # Redraw a bar in place on a terminal; log plain lines when piped
+    interactive = sys.stdout.isatty()
+    interval = PROGRESS_INTERVAL if interactive else PROGRESS_LOG_INTERVAL
+    # Text written so far must reach the terminal before raw bytes do
+    sys.stdout.flush()
 
     def callback(transferred, total):
         if total > 0:
             percent = int(transferred * 100 / total)
-            if percent != last_percent[0]:
+            now = time.monotonic()
+            if percent != last_percent[0] and (
+                    now - last_time[0] >= interval or transferred == total):
                 last_percent[0] = percent
-                bar_len = 40
-                filled = int(bar_len * transferred / total)
-                bar = '=' * filled + '-' * (bar_len - filled)
-                size_mb = total / (1024 * 1024)
-                transferred_mb = transferred / (1024 * 1024)
-                sys.stdout.write(f'\r{description}: [{bar}] {percent}% ({transferred_mb:.1f}/{size_mb:.1f} MB)')
-                sys.stdout.flush()
-                if percent == 100:
-                    sys.stdout.write('\n')
+                last_time[0] = now
+                if interactive:
+                    bar = PROGRESS_BARS[PROGRESS_BAR_LEN * transferred // total]
+                    line = b'\r%s: [%s] %d%% (%.1f/%.1f MB)' % (
+                        label, bar, percent, transferred / MB, total / MB)
+                    if percent == 100:
+                        line += b'\n'
+                else:
+                    line = b'%s: %d%% (%.1f/%.1f MB)\n' % (
+                        label, percent, transferred / MB, total / MB)
+                out.write(line)
+                out.flush()
 
     return callback
 
 
 def create_dir_progress_callback():
     """Create a progress callback for directory transfers"""
+    last_time = [0.0]
+    interactive = sys.stdout.isatty()
+    interval = PROGRESS_INTERVAL if interactive else PROGRESS_LOG_INTERVAL
+
     def callback(current_file, transferred, total):
         if total > 0:
+            now = time.monotonic()
+            if now - last_time[0] < interval and transferred != total:
+                return
+            last_time[0] = now
             percent = int(transferred * 100 / total)
             filename = os.path.basename(current_file)
+            if not interactive:
+                sys.stdout.write(f'{filename}: {percent}%\n')
+                sys.stdout.flush()
+                return
             if len(filename) > 30:
                 filename = filename[:27] + '...'
             sys.stdout.write(f'\r{filename}: {percent}%   ')
@@ -250,38 +258,47 @@ def get_command(args):
 
 def cli():
     parser = argparse.ArgumentParser(description="VPS SSH Wrapper", formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log connection events to stderr')
     subparsers = parser.add_subparsers(dest='subcommand', required=True)
     
     # cmd
     cmd_p = subparsers.add_parser('cmd', help='Run single command')
     cmd_p.add_argument('command', nargs='+', help='Command to execute')
     cmd_p.add_argument('--timeout', type=int, default=300, help='Command timeout (s)')
+    cmd_p.set_defaults(func=cmd)
     
+    # batch
+    batch_p = subparsers.add_parser('batch', help='Run commands from a file (one per line) over one connection')
+    batch_p.add_argument('file', nargs='?', default='-', help="File of commands, or '-' for stdin (default)")
+    batch_p.add_argument('--timeout', type=int, default=300, help='Per-command timeout (s)')
+    batch_p.add_argument('-k', '--keep-going', action='store_true', help='Continue after a command fails')
+    batch_p.set_defaults(func=cmd_many)
+
     # shell
-    subparsers.add_parser('shell', help='Interactive shell')
+    shell_p = subparsers.add_parser('shell', help='Interactive shell')
+    shell_p.set_defaults(func=shell)
 
     # put
     put_p = subparsers.add_parser('put', help='Upload file or directory to remote')
     put_p.add_argument('local', help='Local file or directory path')
     put_p.add_argument('remote', help='Remote destination path')
     put_p.add_argument('-q', '--quiet', action='store_true', help='Suppress progress output')
+    put_p.set_defaults(func=put_command)
 
     # get
     get_p = subparsers.add_parser('get', help='Download file or directory from remote')
     get_p.add_argument('remote', help='Remote file or directory path')
     get_p.add_argument('local', help='Local destination path')
     get_p.add_argument('-q', '--quiet', action='store_true', help='Suppress progress output')
+    get_p.set_defaults(func=get_command)
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s', stream=sys.stderr)
+    if args.verbose:
+        for name in VERBOSE_LOGGERS:
+            logging.getLogger(name).setLevel(logging.INFO)
 
-    if args.subcommand == 'cmd':
-        cmd(args)
-    elif args.subcommand == 'shell':
-        shell(args)
-    elif args.subcommand == 'put':
-        put_command(args)
-    elif args.subcommand == 'get':
-        get_command(args)
+    args.func(args)
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -1,22 +1,283 @@
+import logging
+import mmap
 import paramiko
+import queue
+import select
+import shlex
+import stat
 import time
 import os
-from threading import Lock
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+
+logger = logging.getLogger(__name__)
+
+# Per-channel flow-control window and max packet size for every channel on the
+# transport, sized for high bandwidth-delay links instead of paramiko's 2 MiB/32 KiB
+CHANNEL_WINDOW_SIZE = 2 ** 27
+CHANNEL_MAX_PACKET_SIZE = 2 ** 19
+# Bytes pulled from an exec channel per recv() call
+EXEC_RECV_SIZE = 128 * 1024
+# Outstanding read requests per download, matching OpenSSH sftp's -R default
+SFTP_MAX_REQUESTS = 64
+# Concurrent SFTP channels used for directory transfers
+TRANSFER_WORKERS = 8
+# Chunk size used while copying to or from SFTP
+TRANSFER_BUFFER_SIZE = 1024 * 1024
+# Argument bytes per 'mkdir -p' command, far below any remote ARG_MAX
+MKDIR_ARGS_MAX = 64 * 1024
+# Seconds to wait on 'mkdir -p' before falling back to SFTP; an exec on an
+# SFTP-only account can hang in sftp-server rather than fail
+MKDIR_EXEC_TIMEOUT = 5
+# Maps local Windows separators onto the '/' SFTP paths use
+_REMOTE_SEP = str.maketrans('\\', '/')
+
+
+def _upload_file(sftp, local_path, remote_path, file_size, callback=None):
+    """Upload one file straight from an mmap of it, with pipelined writes"""
+    with sftp.open(remote_path, 'wb', bufsize=0) as remote:
+        remote.set_pipelined(True)
+        if file_size == 0:
+            return
+        with open(local_path, 'rb', buffering=0) as local:
+            try:
+                # Slicing the map hands paramiko zero-copy views instead of fresh
+                # bytes per chunk. The map is unmapped along with the last view,
+                # so a failed write can't turn into a BufferError on close.
+                view = memoryview(mmap.mmap(local.fileno(), 0, access=mmap.ACCESS_READ))
+            except (OSError, ValueError):
+                # Not mappable (special or some network filesystems): fall back
+                # to reading into one reused buffer
+                _upload_stream(remote, local, file_size, callback)
+                return
+        for offset in range(0, len(view), TRANSFER_BUFFER_SIZE):
+            remote.write(view[offset:offset + TRANSFER_BUFFER_SIZE])
+            if callback:
+                callback(min(offset + TRANSFER_BUFFER_SIZE, len(view)), file_size)
+
+
+def _upload_stream(remote, local, file_size, callback=None):
+    """Copy a local file object to an open SFTP file through one reused buffer"""
+    # paramiko packs each write into its packet before returning, so the
+    # buffer can be refilled straight away
+    buf = bytearray(TRANSFER_BUFFER_SIZE)
+    view = memoryview(buf)
+    transferred = 0
+    while True:
+        n = local.readinto(buf)
+        if not n:
+            break
+        remote.write(view[:n])
+        transferred += n
+        if callback:
+            callback(transferred, file_size)
+
+
+def _download_file(sftp, remote_path, local_path, file_size, callback=None):
+    """Download one file of known size with prefetched (pipelined) reads"""
+    transferred = 0
+    with sftp.open(remote_path, 'rb') as remote, \
+            open(local_path, 'wb', buffering=TRANSFER_BUFFER_SIZE) as local:
+        remote.prefetch(file_size, max_concurrent_requests=SFTP_MAX_REQUESTS)
+        # Reading one request-sized block at a time hands back prefetched
+        # buffers as-is instead of concatenating them
+        block_size = remote.MAX_REQUEST_SIZE
+        while True:
+            data = remote.read(block_size)
+            if not data:
+                break
+            local.write(data)
+            transferred += len(data)
+            if callback:
+                callback(transferred, file_size)
+    if transferred != file_size:
+        raise IOError(f"size mismatch in get! {transferred} != {file_size}")
+
+
+def _mkdir_p_commands(remote_dirs):
+    """Build 'mkdir -p' shell commands creating remote_dirs, batched by MKDIR_ARGS_MAX"""
+    commands = []
+    batch = []
+    batch_len = 0
+    for remote_dir in remote_dirs:
+        arg = shlex.quote(remote_dir)
+        if batch and batch_len + len(arg) > MKDIR_ARGS_MAX:
+            commands.append("mkdir -p -- " + " ".join(batch))
+            batch = []
+            batch_len = 0
+        batch.append(arg)
+        batch_len += len(arg) + 1
+    if batch:
+        commands.append("mkdir -p -- " + " ".join(batch))
+    return commands
+
+
+def _deepest_dir(remote_dirs):
+    """The most deeply nested of remote_dirs, whose existence implies its parents'"""
+    return max(remote_dirs, key=lambda remote_dir: remote_dir.rstrip('/').count('/'))
+
+
+def _scan_local_tree(local_root):
+    """
+    Walk a local tree like os.walk(), yielding (rel_path, dirnames, file_entries)
+    per directory. rel_path is '/'-separated ('' for the root) and files come as
+    os.DirEntry objects, so sizes come from entry.stat() rather than a getsize()
+    per path.
+    """
+    pending = ['']
+    while pending:
+        rel_path = pending.pop()
+        root = os.path.join(local_root, rel_path) if rel_path else local_root
+        dirnames = []
+        file_entries = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        dirnames.append(entry.name)
+                        # Like os.walk(), list directory symlinks but don't descend
+                        if not entry.is_symlink():
+                            pending.append(f"{rel_path}/{entry.name}" if rel_path else entry.name)
+                    else:
+                        file_entries.append(entry)
+        except OSError:
+            continue
+        yield rel_path, dirnames, file_entries
+
+
+def _plan_upload(local_dir, remote_dir):
+    """
+    Scan a local tree for put_dir, mapping it onto remote_dir.
+
+    Returns:
+        tuple: (remote_base, subdir_groups, jobs, failed_files) where
+               subdir_groups lists each directory's remote subdirectories
+               (parents before children) and jobs holds
+               (local_path, remote_path, size) tuples
+    """
+    # Build remote paths with plain '/' joins onto the scan's '/'-separated
+    # relative paths
+    remote_base = remote_dir.translate(_REMOTE_SEP).rstrip('/') or '/'
+    subdir_groups = []
+    jobs = []
+    failed_files = []
+    for rel_path, dirs, file_entries in _scan_local_tree(local_dir):
+        current_remote_dir = f"{remote_base.rstrip('/')}/{rel_path}" if rel_path else remote_base
+        parent = current_remote_dir.rstrip('/')
+        subdir_groups.append([f"{parent}/{d}" for d in dirs])
+
+        for entry in file_entries:
+            try:
+                jobs.append((entry.path, f"{parent}/{entry.name}", entry.stat().st_size))
+            except OSError as e:
+                failed_files.append({'file': entry.path, 'error': str(e)})
+    return remote_base, subdir_groups, jobs, failed_files
+
+
+def _split_listing(remote_path, local_path, ancestors, entries):
+    """
+    Sort the entries of one remote directory listing.
+
+    Args:
+        ancestors: Real paths of the listed directory and its ancestors
+        entries: (filename, mode, size, link_target) tuples, with mode and
+                 size those of a symlink's target and link_target the real
+                 path of a symlinked directory (None otherwise)
+
+    Returns:
+        tuple: (subdirs, files) where subdirs holds (remote_path, local_path,
+               ancestors) tuples and files (remote_path, local_path, size) tuples
+    """
+    subdirs = []
+    files = []
+    for filename, mode, size, link_target in entries:
+        if filename in ('.', '..'):
+            continue
+        remote_entry = f"{remote_path.rstrip('/')}/{filename}"
+        local_entry = os.path.join(local_path, filename)
+        if stat.S_ISDIR(mode or 0):
+            real_path = f"{ancestors[-1].rstrip('/')}/{filename}"
+            if link_target is not None:
+                # Following a link back up the tree would never end, and a
+                # server whose realpath leaves links unresolved hides such loops
+                if link_target == real_path:
+                    logger.info("Not following %s: the server doesn't resolve symlinks", remote_entry)
+                    continue
+                if any(a == link_target or a.startswith(link_target.rstrip('/') + '/')
+                       for a in ancestors):
+                    logger.info("Not following %s: it loops back to %s", remote_entry, link_target)
+                    continue
+                real_path = link_target
+            subdirs.append((remote_entry, local_entry, ancestors + (real_path,)))
+        else:
+            files.append((remote_entry, local_entry, size or 0))
+    return subdirs, files
+
+
+def _tally_transfers(jobs, errors):
+    """
+    Total the (source, destination, size) jobs whose error is None.
+
+    Returns:
+        tuple: (files_transferred, total_bytes, failed_files)
+    """
+    failed_files = [err for err in errors if err is not None]
+    files_transferred = 0
+    total_bytes = 0
+    for (source, destination, size), err in zip(jobs, errors):
+        if err is None:
+            files_transferred += 1
+            total_bytes += size
+    return files_transferred, total_bytes, failed_files
+
+
+def _file_result(bytes_transferred=0, error=None):
+    """Result dict of put() and get()"""
+    return {
+        'success': error is None,
+        'error': error,
+        'bytes_transferred': bytes_transferred
+    }
+
+
+def _dir_result(files_transferred=0, total_bytes=0, failed_files=(), error=None):
+    """Result dict of put_dir() and get_dir(); failed files make it a failure"""
+    failed_files = list(failed_files)
+    if error is None and failed_files:
+        error = f"{len(failed_files)} files failed"
+    return {
+        'success': error is None,
+        'error': error,
+        'files_transferred': files_transferred,
+        'total_bytes': total_bytes,
+        'failed_files': failed_files
+    }
 
-# Load environment variables from .env file
-load_dotenv()
 
 class PersistentSSH:
-    def __init__(self, hostname, username, password=None, key_filename=None, port=22):
+    def __init__(self, hostname, username, password=None, key_filename=None, port=22,
+                 look_for_keys=False, allow_agent=False, compress=False):
         self.hostname = hostname
         self.username = username
         self.password = password
         self.key_filename = key_filename
         self.port = port
+        self.look_for_keys = look_for_keys
+        self.allow_agent = allow_agent
+        self.compress = compress
         self.ssh = None
         self.sftp = None
+        self._sftp_pool = queue.Queue()
+        # Serializes SFTP use of the shared client; commands don't take it
         self.lock = Lock()
+        # Held while self.ssh is being replaced
+        self._conn_lock = RLock()
+        self._alive_ttl = 5.0
+        self._last_alive_check = 0.0
+        self._sftp_ttl = 30.0
+        self._sftp_checked_at = 0.0
+        # Whether 'mkdir -p' over exec works on this connection; None until tried
+        self._exec_mkdir_ok = None
         self.connect()
     
     def connect(self):
@@ -24,26 +285,37 @@ class PersistentSSH:
         try:
             self.ssh = paramiko.SSHClient()
             self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
+
+            # Only the configured credential is tried; probing the agent and
+            # ~/.ssh/id_* keys first costs extra auth round trips
+            connect_kwargs = dict(
+                hostname=self.hostname,
+                port=self.port,
+                username=self.username,
+                timeout=10,
+                banner_timeout=10,
+                auth_timeout=10,
+                look_for_keys=self.look_for_keys,
+                allow_agent=self.allow_agent,
+                compress=self.compress
+            )
             if self.key_filename:
-                self.ssh.connect(
-                    hostname=self.hostname,
-                    port=self.port,
-                    username=self.username,
-                    key_filename=self.key_filename,
-                    timeout=10
-                )
+                connect_kwargs['key_filename'] = self.key_filename
             else:
-                self.ssh.connect(
-                    hostname=self.hostname,
-                    port=self.port,
-                    username=self.username,
-                    password=self.password,
-                    timeout=10
-                )
-            print(f"Connected to {self.hostname}")
+                connect_kwargs['password'] = self.password
+
+            self.ssh.connect(**connect_kwargs)
+            transport = self.ssh.get_transport()
+            # Applies to every channel opened from here on (exec, shell, SFTP)
+            transport.default_window_size = CHANNEL_WINDOW_SIZE
+            transport.default_max_packet_size = CHANNEL_MAX_PACKET_SIZE
+            # Keep idle connections (e.g. between batched commands) from being dropped
+            transport.set_keepalive(30)
+            self._last_alive_check = time.monotonic()
+            self._exec_mkdir_ok = None
+            logger.info("Connected to %s", self.hostname)
         except Exception as e:
-            print(f"Connection failed: {e}")
+            logger.warning("Connection failed: %s", e)
             raise
     
     def is_connected(self):
@@ -54,66 +326,265 @@ class PersistentSSH:
             transport = self.ssh.get_transport()
             if transport is None or not transport.is_active():
                 return False
+            # Trust a recent check instead of paying for another probe
+            now = time.monotonic()
+            if now - self._last_alive_check < self._alive_ttl:
+                return True
             transport.send_ignore()
+            self._last_alive_check = now
             return True
         except:
             return False
     
     def reconnect(self):
         """Reconnect if connection is lost"""
-        print("Reconnecting...")
-        self.close()
-        time.sleep(2)
-        self.connect()
-    
-    def execute(self, command, timeout=30):
-        """Execute a command with automatic reconnection"""
-        with self.lock:
-            if not self.is_connected():
+        with self._conn_lock:
+            logger.info("Reconnecting to %s...", self.hostname)
+            self.close()
+            time.sleep(2)
+            self.connect()
+
+    def _reconnect_from(self, ssh):
+        """Reconnect, unless another thread already replaced the failed client ssh"""
+        with self._conn_lock:
+            if self.ssh is ssh:
                 self.reconnect()
-            
-            try:
-                stdin, stdout, stderr = self.ssh.exec_command(command, timeout=timeout)
-                output = stdout.read().decode('utf-8')
-                error = stderr.read().decode('utf-8')
-                exit_status = stdout.channel.recv_exit_status()
-                
-                return {
-                    'output': output,
-                    'error': error,
-                    'exit_status': exit_status
-                }
-            except Exception as e:
-                print(f"Command execution failed: {e}")
-                # Try to reconnect and retry once
-                self.reconnect()
-                stdin, stdout, stderr = self.ssh.exec_command(command, timeout=timeout)
-                output = stdout.read().decode('utf-8')
-                error = stderr.read().decode('utf-8')
-                exit_status = stdout.channel.recv_exit_status()
-                
-                return {
-                    'output': output,
-                    'error': error,
-                    'exit_status': exit_status
-                }
+    
+    def execute(self, command, timeout=30, decode=True):
+        """Execute a command with automatic reconnection.
+
+        Output and error are returned as str, or as raw bytes when decode=False.
+        Each command gets its own channel on the shared transport, so calls
+        from several threads run concurrently.
+        """
+        ssh = self.ssh
+        if not self.is_connected():
+            self._reconnect_from(ssh)
+            ssh = self.ssh
+
+        try:
+            result = self._run_command(command, timeout)
+        except Exception as e:
+            logger.warning("Command execution failed: %s", e)
+            # Only a dead transport is worth a reconnect: other threads share a
+            # live one, and a timed-out command may still be running remotely
+            transport = ssh.get_transport()
+            if isinstance(e, TimeoutError) or (transport is not None and transport.is_active()):
+                raise
+            # Try to reconnect and retry once
+            self._reconnect_from(ssh)
+            result = self._run_command(command, timeout)
+
+        # Decode once the command is done, so undecodable output is reported
+        # to the caller instead of being retried as a failed command
+        if decode:
+            result['output'] = result['output'].decode('utf-8')
+            result['error'] = result['error'].decode('utf-8')
+        return result
+
+    def _run_command(self, command, timeout):
+        """Run a command, collecting stdout and stderr as bytes as they arrive"""
+        stdin, stdout, stderr = self.ssh.exec_command(command, timeout=timeout)
+        channel = stdout.channel
+        output = []
+        error = []
+        last_activity = time.monotonic()
+
+        try:
+            while (not channel.exit_status_ready() or channel.recv_ready()
+                   or channel.recv_stderr_ready()):
+                select.select([channel], [], [], 1.0)
+                got_data = False
+                if channel.recv_ready():
+                    output.append(channel.recv(EXEC_RECV_SIZE))
+                    got_data = True
+                if channel.recv_stderr_ready():
+                    error.append(channel.recv_stderr(EXEC_RECV_SIZE))
+                    got_data = True
+
+                now = time.monotonic()
+                if got_data:
+                    last_activity = now
+                elif timeout is not None and now - last_activity > timeout:
+                    raise TimeoutError(f"No output from command for {timeout}s")
+        except BaseException:
+            # Timeout, Ctrl-C or a channel error: drop just this command's
+            # channel so the remote command isn't left running; the
+            # transport stays usable
+            channel.close()
+            raise
+
+        exit_status = channel.recv_exit_status()
+
+        return {
+            'output': b''.join(output),
+            'error': b''.join(error),
+            'exit_status': exit_status
+        }
     
     def get_sftp(self):
         """Get or create SFTP client with auto-reconnection"""
         if not self.is_connected():
             self.reconnect()
 
+        # A closed channel is caught for free; the stat round trip is only
+        # repeated every _sftp_ttl seconds, since keepalives and the
+        # per-operation reconnect handle connections that die in between
         if self.sftp is not None:
-            try:
-                self.sftp.stat('.')
-            except Exception:
+            if self.sftp.get_channel().closed:
                 self.sftp = None
+            elif time.monotonic() - self._sftp_checked_at >= self._sftp_ttl:
+                try:
+                    self.sftp.stat('.')
+                    self._sftp_checked_at = time.monotonic()
+                except Exception:
+                    self.sftp = None
 
         if self.sftp is None:
-            self.sftp = self.ssh.open_sftp()
+            self.sftp = self._open_sftp()
+            self._sftp_checked_at = time.monotonic()
 
         return self.sftp
 
+    def _open_sftp(self):
+        """Open a new SFTP channel on the current transport"""
+        return self.ssh.get_transport().open_sftp_client()
+
+    def _borrow_sftp(self):
+        """Take an idle SFTP channel from the transfer pool, opening one if none is free"""
+        try:
+            return self._sftp_pool.get_nowait()
+        except queue.Empty:
+            return self._open_sftp()
+
+    def _return_sftp(self, sftp):
+        """Give a borrowed SFTP channel back to the transfer pool"""
+        if sftp.get_channel().closed:
+            return
+        self._sftp_pool.put(sftp)
+
+    def _close_sftp_pool(self):
+        while True:
+            try:
+                sftp = self._sftp_pool.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+    def _walk_remote(self, remote_root, local_root):
+        """
+        List a remote tree breadth-first, listing each level's directories
+        concurrently over the SFTP pool so deep trees don't cost one serial
+        round trip per directory.
+
+        Returns:
+            tuple: (local_dirs, files, failed_dirs) where files holds
+                   (remote_path, local_path, size) tuples and failed_dirs
+                   {'file', 'error'} dicts for directories that couldn't be listed
+        """
+        local_dirs = []
+        files = []
+        failed_dirs = []
+
+        def list_dir(item):
+            remote_path, local_path, ancestors = item
+            sftp = self._borrow_sftp()
+            try:
+                entries = []
+                for entry in sftp.listdir_attr(remote_path):
+                    # Listings describe symlinks themselves; size and walk
+                    # them as what they point to
+                    mode, size, link_target = entry.st_mode, entry.st_size, None
+                    if stat.S_ISLNK(mode or 0):
+                        link_path = f"{remote_path.rstrip('/')}/{entry.filename}"
+                        try:
+                            target = sftp.stat(link_path)
+                            mode, size = target.st_mode, target.st_size
+                            if stat.S_ISDIR(mode):
+                                link_target = sftp.normalize(link_path)
+                        except IOError:
+                            # Dangling: its download reports the error
+                            pass
+                    entries.append((entry.filename, mode, size, link_target))
+                return entries, None
+            except IOError as e:
+                # One unreadable directory shouldn't abort the whole walk
+                return [], {'file': remote_path, 'error': str(e)}
+            finally:
+                self._return_sftp(sftp)
+
+        sftp = self._borrow_sftp()
+        try:
+            root_real_path = sftp.normalize(remote_root)
+        finally:
+            self._return_sftp(sftp)
+
+        level = [(remote_root, local_root, (root_real_path,))]
+        with ThreadPoolExecutor(max_workers=TRANSFER_WORKERS) as pool:
+            while level:
+                next_level = []
+                for (remote_path, local_path, ancestors), (entries, err) in zip(level, pool.map(list_dir, level)):
+                    if err is not None:
+                        failed_dirs.append(err)
+                    subdirs, dir_files = _split_listing(remote_path, local_path, ancestors, entries)
+                    local_dirs.extend(local_entry for _, local_entry, _ in subdirs)
+                    next_level.extend(subdirs)
+                    files.extend(dir_files)
+                level = next_level
+
+        return local_dirs, files, failed_dirs
+
+    def _transfer_files(self, jobs, transfer, callback=None):
+        """
+        Run per-file transfers concurrently over a pool of SFTP channels.
+
+        SFTPClient is not thread-safe, so each running transfer borrows its
+        own channel; the channels multiplex over the one SSH transport and
+        stay open for later transfers.
+
+        Args:
+            jobs: List of (source, destination, size) tuples
+            transfer: Function(sftp, source, destination, size, callback) doing one file
+            callback: Optional progress callback(current_file, bytes_transferred, total_bytes)
+
+        Returns:
+            tuple: (files_transferred, total_bytes, failed_files)
+        """
+        callback_lock = Lock()
+
+        def file_callback_for(source):
+            """Per-file callback(transferred, total) forwarding to callback, or None"""
+            if not callback:
+                return None
+
+            def file_callback(transferred, total):
+                with callback_lock:
+                    callback(source, transferred, total)
+            return file_callback
+
+        def run(job):
+            source, destination, size = job
+            file_callback = file_callback_for(source)
+            try:
+                sftp = self._borrow_sftp()
+            except Exception as e:
+                return {'file': source, 'error': str(e)}
+            try:
+                transfer(sftp, source, destination, size, file_callback)
+                return None
+            except Exception as e:
+                return {'file': source, 'error': str(e)}
+            finally:
+                self._return_sftp(sftp)
+
+        with ThreadPoolExecutor(max_workers=TRANSFER_WORKERS) as pool:
+            errors = list(pool.map(run, jobs))
+
+        return _tally_transfers(jobs, errors)
+
     def put(self, local_path, remote_path, callback=None):
         """
         Upload a single file to remote server.
@@ -135,28 +606,15 @@ class PersistentSSH:
         with self.lock:
             try:
                 sftp = self.get_sftp()
-                sftp.put(local_path, remote_path, callback=callback)
-                return {
-                    'success': True,
-                    'error': None,
-                    'bytes_transferred': file_size
-                }
+                _upload_file(sftp, local_path, remote_path, file_size, callback)
             except IOError as e:
-                return {
-                    'success': False,
-                    'error': str(e),
-                    'bytes_transferred': 0
-                }
-            except Exception as e:
+                return _file_result(error=str(e))
+            except Exception:
                 self.sftp = None
                 self.reconnect()
                 sftp = self.get_sftp()
-                sftp.put(local_path, remote_path, callback=callback)
-                return {
-                    'success': True,
-                    'error': None,
-                    'bytes_transferred': file_size
-                }
+                _upload_file(sftp, local_path, remote_path, file_size, callback)
+            return _file_result(file_size)
 
     def get(self, remote_path, local_path, callback=None):
         """
@@ -179,31 +637,49 @@ class PersistentSSH:
         with self.lock:
             try:
                 sftp = self.get_sftp()
-                file_stat = sftp.stat(remote_path)
-                file_size = file_stat.st_size
-                sftp.get(remote_path, local_path, callback=callback)
-                return {
-                    'success': True,
-                    'error': None,
-                    'bytes_transferred': file_size
-                }
+                file_size = sftp.stat(remote_path).st_size
+                _download_file(sftp, remote_path, local_path, file_size, callback)
             except IOError as e:
-                return {
-                    'success': False,
-                    'error': str(e),
-                    'bytes_transferred': 0
-                }
-            except Exception as e:
+                return _file_result(error=str(e))
+            except Exception:
                 self.sftp = None
                 self.reconnect()
                 sftp = self.get_sftp()
-                file_stat = sftp.stat(remote_path)
-                sftp.get(remote_path, local_path, callback=callback)
-                return {
-                    'success': True,
-                    'error': None,
-                    'bytes_transferred': file_stat.st_size
-                }
+                file_size = sftp.stat(remote_path).st_size
+                _download_file(sftp, remote_path, local_path, file_size, callback)
+            return _file_result(file_size)
+
+    def _mkdir_p_exec(self, sftp, remote_dirs):
+        """
+        Create remote directories, parents included, with 'mkdir -p' over exec.
+
+        Returns:
+            bool: True if all were created, False if the caller should fall
+                  back to SFTP (no shell access, or mkdir failed)
+        """
+        if self._exec_mkdir_ok is False:
+            return False
+        for command in _mkdir_p_commands(remote_dirs):
+            try:
+                # Not execute(): a refused exec shouldn't cost a reconnect
+                result = self._run_command(command, timeout=MKDIR_EXEC_TIMEOUT)
+            except Exception as e:
+                logger.info("mkdir -p over exec failed, using SFTP: %s", e)
+                self._exec_mkdir_ok = False
+                return False
+            if result['exit_status'] != 0:
+                return False
+        if self._exec_mkdir_ok is None:
+            # A ForceCommand internal-sftp account runs sftp-server instead,
+            # which can exit 0 without creating anything
+            try:
+                sftp.stat(_deepest_dir(remote_dirs))
+            except IOError:
+                logger.info("mkdir -p over exec did not create directories, using SFTP")
+                self._exec_mkdir_ok = False
+                return False
+            self._exec_mkdir_ok = True
+        return True
 
     def put_dir(self, local_dir, remote_dir, callback=None):
         """
@@ -218,81 +694,55 @@ class PersistentSSH:
             dict: {'success': bool, 'error': str or None,
                    'files_transferred': int, 'total_bytes': int, 'failed_files': list}
         """
-        import stat
-
         local_dir = os.path.expanduser(local_dir)
         if not os.path.isdir(local_dir):
             raise NotADirectoryError(f"Local directory not found: {local_dir}")
 
-        files_transferred = 0
-        total_bytes = 0
-        failed_files = []
+        remote_base, subdir_groups, jobs, failed_files = _plan_upload(local_dir, remote_dir)
+        remote_subdirs = [d for group in subdir_groups for d in group]
 
         with self.lock:
             sftp = self.get_sftp()
 
-            def mkdir_p(remote_directory):
-                if remote_directory == '/':
-                    return
-                try:
-                    sftp.stat(remote_directory)
-                except IOError:
+            # One 'mkdir -p' creates the whole tree in a single round trip;
+            # accounts without a shell fall back to one SFTP mkdir per directory
+            if not self._mkdir_p_exec(sftp, [remote_base] + remote_subdirs):
+                # Directories known to exist remotely, and the subset this upload
+                # created (which can't have children yet, so need no stat)
+                known_dirs = set()
+                new_dirs = set()
+
+                def mkdir_p(remote_directory):
+                    if remote_directory == '/' or remote_directory in known_dirs:
+                        return
                     dirname = os.path.dirname(remote_directory)
+                    if dirname not in new_dirs:
+                        try:
+                            sftp.stat(remote_directory)
+                            known_dirs.add(remote_directory)
+                            return
+                        except IOError:
+                            pass
                     if dirname:
                         mkdir_p(dirname)
                     sftp.mkdir(remote_directory)
+                    known_dirs.add(remote_directory)
+                    new_dirs.add(remote_directory)
 
-            try:
-                mkdir_p(remote_dir)
-            except Exception as e:
-                return {
-                    'success': False,
-                    'error': f"Failed to create remote directory: {e}",
-                    'files_transferred': 0,
-                    'total_bytes': 0,
-                    'failed_files': []
-                }
-
-            for root, dirs, files in os.walk(local_dir):
-                rel_path = os.path.relpath(root, local_dir)
-                if rel_path == '.':
-                    current_remote_dir = remote_dir
-                else:
-                    current_remote_dir = os.path.join(remote_dir, rel_path).replace('\\', '/')
-
-                for d in dirs:
-                    remote_subdir = os.path.join(current_remote_dir, d).replace('\\', '/')
+                try:
+                    mkdir_p(remote_base)
+                except Exception as e:
+                    return _dir_result(error=f"Failed to create remote directory: {e}")
+
+                for remote_subdir in remote_subdirs:
                     try:
                         mkdir_p(remote_subdir)
                     except Exception:
                         pass
 
-                for f in files:
-                    local_file = os.path.join(root, f)
-                    remote_file = os.path.join(current_remote_dir, f).replace('\\', '/')
-
-                    try:
-                        file_size = os.path.getsize(local_file)
-
-                        if callback:
-                            def file_callback(transferred, total, lf=local_file):
-                                callback(lf, transferred, total)
-                            sftp.put(local_file, remote_file, callback=file_callback)
-                        else:
-                            sftp.put(local_file, remote_file)
-
-                        files_transferred += 1
-                        total_bytes += file_size
-                    except Exception as e:
-                        failed_files.append({'file': local_file, 'error': str(e)})
-
-        return {
-            'success': len(failed_files) == 0,
-            'error': None if len(failed_files) == 0 else f"{len(failed_files)} files failed",
-            'files_transferred': files_transferred,
-            'total_bytes': total_bytes,
-            'failed_files': failed_files
-        }
+        # Each worker owns its SFTP channel, so the copies need no lock
+        files_transferred, total_bytes, errors = self._transfer_files(jobs, _upload_file, callback)
+        return _dir_result(files_transferred, total_bytes, failed_files + errors)
 
     def get_dir(self, remote_dir, local_dir, callback=None):
         """
@@ -307,12 +757,7 @@ class PersistentSSH:
             dict: {'success': bool, 'error': str or None,
                    'files_transferred': int, 'total_bytes': int, 'failed_files': list}
         """
-        import stat
-
         local_dir = os.path.expanduser(local_dir)
-        files_transferred = 0
-        total_bytes = 0
-        failed_files = []
 
         with self.lock:
             sftp = self.get_sftp()
@@ -320,60 +765,23 @@ class PersistentSSH:
             try:
                 remote_stat = sftp.stat(remote_dir)
                 if not stat.S_ISDIR(remote_stat.st_mode):
-                    return {
-                        'success': False,
-                        'error': f"Remote path is not a directory: {remote_dir}",
-                        'files_transferred': 0,
-                        'total_bytes': 0,
-                        'failed_files': []
-                    }
+                    return _dir_result(error=f"Remote path is not a directory: {remote_dir}")
             except IOError:
-                return {
-                    'success': False,
-                    'error': f"Remote directory not found: {remote_dir}",
-                    'files_transferred': 0,
-                    'total_bytes': 0,
-                    'failed_files': []
-                }
+                return _dir_result(error=f"Remote directory not found: {remote_dir}")
 
             os.makedirs(local_dir, exist_ok=True)
 
-            def download_recursive(remote_path, local_path):
-                nonlocal files_transferred, total_bytes, failed_files
+        local_dirs, jobs, failed_files = self._walk_remote(remote_dir, local_dir)
+        for local_path in local_dirs:
+            os.makedirs(local_path, exist_ok=True)
 
-                for entry in sftp.listdir_attr(remote_path):
-                    remote_entry = os.path.join(remote_path, entry.filename).replace('\\', '/')
-                    local_entry = os.path.join(local_path, entry.filename)
-
-                    if stat.S_ISDIR(entry.st_mode):
-                        os.makedirs(local_entry, exist_ok=True)
-                        download_recursive(remote_entry, local_entry)
-                    else:
-                        try:
-                            if callback:
-                                def file_callback(transferred, total, rf=remote_entry):
-                                    callback(rf, transferred, total)
-                                sftp.get(remote_entry, local_entry, callback=file_callback)
-                            else:
-                                sftp.get(remote_entry, local_entry)
-
-                            files_transferred += 1
-                            total_bytes += entry.st_size
-                        except Exception as e:
-                            failed_files.append({'file': remote_entry, 'error': str(e)})
-
-            download_recursive(remote_dir, local_dir)
-
-        return {
-            'success': len(failed_files) == 0,
-            'error': None if len(failed_files) == 0 else f"{len(failed_files)} files failed",
-            'files_transferred': files_transferred,
-            'total_bytes': total_bytes,
-            'failed_files': failed_files
-        }
+        # Each worker owns its SFTP channel, so the copies need no lock
+        files_transferred, total_bytes, errors = self._transfer_files(jobs, _download_file, callback)
+        return _dir_result(files_transferred, total_bytes, failed_files + errors)
 
     def close(self):
         """Close the SSH and SFTP connections"""
+        self._close_sftp_pool()
         if self.sftp:
             try:
                 self.sftp.close()
@@ -384,9 +792,20 @@ class PersistentSSH:
             self.ssh.close()
             self.ssh = None
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 # Usage example
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # Load credentials from .env file
+    load_dotenv()
     login = os.getenv('login')  # Format: username@hostname
     password = os.getenv('password')
 
@@ -0,0 +1,500 @@
+"""
+asyncssh backend for PersistentSSH.
+
+AsyncPersistentSSH offers the operations of ssh_util.PersistentSSH as
+coroutines over one asyncssh connection. asyncssh pipelines SFTP reads and
+writes natively and lets many transfers share a single SFTP session, so
+directory transfers need no thread or channel pool.
+
+PersistentSSH here is a blocking drop-in for ssh_util.PersistentSSH that
+runs AsyncPersistentSSH on a private event loop; like the paramiko class,
+it is meant to be used from one thread.
+
+Requires the optional asyncssh package: pip install -e '.[async]'
+"""
+import asyncio
+import logging
+import os
+import stat
+import time
+import types
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+from ssh_util import (CHANNEL_MAX_PACKET_SIZE, CHANNEL_WINDOW_SIZE, MKDIR_EXEC_TIMEOUT,
+                      SFTP_MAX_REQUESTS, TRANSFER_WORKERS, _deepest_dir, _dir_result,
+                      _file_result, _mkdir_p_commands, _plan_upload, _split_listing,
+                      _tally_transfers)
+
+logger = logging.getLogger(__name__)
+
+
+def _progress_handler(callback, *args):
+    """asyncssh progress_handler calling callback(*args, transferred, total), or None"""
+    if not callback:
+        return None
+
+    def progress_handler(srcpath, dstpath, transferred, total):
+        callback(*args, transferred, total)
+    return progress_handler
+
+
+class AsyncPersistentSSH:
+    def __init__(self, hostname, username, password=None, key_filename=None, port=22,
+                 look_for_keys=False, allow_agent=False, compress=False):
+        if asyncssh is None:
+            raise ImportError("The asyncssh backend needs asyncssh: pip install -e '.[async]'")
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.port = port
+        self.look_for_keys = look_for_keys
+        self.allow_agent = allow_agent
+        self.compress = compress
+        self.conn = None
+        self.sftp = None
+        self._alive_ttl = 5.0
+        self._last_alive_check = 0.0
+        # Whether 'mkdir -p' over exec works on this connection; None until tried
+        self._exec_mkdir_ok = None
+
+    async def connect(self):
+        """Establish SSH connection"""
+        try:
+            options = dict(
+                port=self.port,
+                username=self.username,
+                # Like paramiko's AutoAddPolicy, accept the server's host key
+                known_hosts=None,
+                connect_timeout=10,
+                login_timeout=10,
+                window=CHANNEL_WINDOW_SIZE,
+                max_pktsize=CHANNEL_MAX_PACKET_SIZE
+            )
+            # Only the configured credential is tried, as with the paramiko backend
+            if not self.allow_agent:
+                options['agent_path'] = None
+            if self.key_filename:
+                options['client_keys'] = [self.key_filename]
+            else:
+                if not self.look_for_keys:
+                    options['client_keys'] = None
+                options['password'] = self.password
+            if self.compress:
+                options['compression_algs'] = ['zlib@openssh.com', 'zlib', 'none']
+
+            self.conn = await asyncssh.connect(self.hostname, **options)
+            self._last_alive_check = time.monotonic()
+            self._exec_mkdir_ok = None
+            logger.info("Connected to %s", self.hostname)
+        except Exception as e:
+            logger.warning("Connection failed: %s", e)
+            raise
+
+    async def is_connected(self):
+        """Check if connection is still alive"""
+        if self.conn is None:
+            return False
+        # The loop only runs during calls, so first let it handle anything
+        # that arrived while idle, such as the server closing the connection
+        await asyncio.sleep(0)
+        if self.conn.is_closed():
+            return False
+        # Trust a recent check instead of paying for another probe
+        now = time.monotonic()
+        if now - self._last_alive_check < self._alive_ttl:
+            return True
+        # A write to a dead connection fails and closes it on the next pass
+        self.conn.send_debug('probe')
+        await asyncio.sleep(0)
+        self._last_alive_check = now
+        return not self.conn.is_closed()
+
+    async def reconnect(self):
+        """Reconnect if connection is lost"""
+        logger.info("Reconnecting to %s...", self.hostname)
+        await self.close()
+        await asyncio.sleep(2)
+        await self.connect()
+
+    async def execute(self, command, timeout=30, decode=True):
+        """Execute a command with automatic reconnection.
+
+        Output and error are returned as str, or as raw bytes when decode=False.
+        Unlike the paramiko backend, timeout bounds the whole command rather
+        than the time between output chunks.
+        """
+        if not await self.is_connected():
+            await self.reconnect()
+
+        try:
+            result = await self._run_command(command, timeout)
+        except Exception as e:
+            logger.warning("Command execution failed: %s", e)
+            # Only a dead connection is worth a reconnect; a timed-out command
+            # may still be running remotely
+            if isinstance(e, TimeoutError) or not self.conn.is_closed():
+                raise
+            # Try to reconnect and retry once
+            await self.reconnect()
+            result = await self._run_command(command, timeout)
+
+        # Decode once the command is done, so undecodable output is reported
+        # to the caller instead of being retried as a failed command
+        if decode:
+            result['output'] = result['output'].decode('utf-8')
+            result['error'] = result['error'].decode('utf-8')
+        return result
+
+    async def _run_command(self, command, timeout):
+        # Leaving the process context closes the channel on every exit path,
+        # so a timed-out command isn't left running on the remote
+        async with await self.conn.create_process(command, encoding=None) as process:
+            result = await process.wait(timeout=timeout)
+        output = result.stdout or b''
+        error = result.stderr or b''
+        return {
+            'output': output,
+            'error': error,
+            'exit_status': result.exit_status if result.exit_status is not None else -1
+        }
+
+    async def get_sftp(self):
+        """Get or create SFTP client with auto-reconnection"""
+        if not await self.is_connected():
+            await self.reconnect()
+
+        if self.sftp is None:
+            self.sftp = await self.conn.start_sftp_client()
+
+        return self.sftp
+
+    async def _transfer_files(self, jobs, transfer, callback=None):
+        """
+        Run per-file transfers concurrently on the one SFTP session.
+
+        Args:
+            jobs: List of (source, destination, size) tuples
+            transfer: SFTPClient.put or SFTPClient.get of the session
+            callback: Optional progress callback(current_file, bytes_transferred, total_bytes)
+
+        Returns:
+            tuple: (files_transferred, total_bytes, failed_files)
+        """
+        limit = asyncio.Semaphore(TRANSFER_WORKERS)
+
+        async def run(job):
+            source, destination, size = job
+            async with limit:
+                try:
+                    await transfer(source, destination, max_requests=SFTP_MAX_REQUESTS,
+                                   progress_handler=_progress_handler(callback, source))
+                    return None
+                except Exception as e:
+                    return {'file': source, 'error': str(e)}
+
+        errors = await asyncio.gather(*(run(job) for job in jobs))
+        return _tally_transfers(jobs, errors)
+
+    async def put(self, local_path, remote_path, callback=None):
+        """
+        Upload a single file to remote server.
+
+        Args:
+            local_path: Local file path
+            remote_path: Remote destination path
+            callback: Optional progress callback(bytes_transferred, total_bytes)
+
+        Returns:
+            dict: {'success': bool, 'error': str or None, 'bytes_transferred': int}
+        """
+        local_path = os.path.expanduser(local_path)
+        if not os.path.isfile(local_path):
+            raise FileNotFoundError(f"Local file not found: {local_path}")
+
+        file_size = os.path.getsize(local_path)
+
+        async def upload():
+            sftp = await self.get_sftp()
+            await sftp.put(local_path, remote_path, max_requests=SFTP_MAX_REQUESTS,
+                           progress_handler=_progress_handler(callback))
+
+        try:
+            await upload()
+        except (IOError, asyncssh.SFTPError) as e:
+            return _file_result(error=str(e))
+        except Exception:
+            await self.reconnect()
+            await upload()
+        return _file_result(file_size)
+
+    async def get(self, remote_path, local_path, callback=None):
+        """
+        Download a single file from remote server.
+
+        Args:
+            remote_path: Remote file path
+            local_path: Local destination path
+            callback: Optional progress callback(bytes_transferred, total_bytes)
+
+        Returns:
+            dict: {'success': bool, 'error': str or None, 'bytes_transferred': int}
+        """
+        local_path = os.path.expanduser(local_path)
+
+        local_dir = os.path.dirname(local_path)
+        if local_dir and not os.path.exists(local_dir):
+            os.makedirs(local_dir)
+
+        async def download():
+            sftp = await self.get_sftp()
+            file_size = (await sftp.stat(remote_path)).size
+            await sftp.get(remote_path, local_path, max_requests=SFTP_MAX_REQUESTS,
+                           progress_handler=_progress_handler(callback))
+            return file_size
+
+        try:
+            file_size = await download()
+        except (IOError, asyncssh.SFTPError) as e:
+            return _file_result(error=str(e))
+        except Exception:
+            await self.reconnect()
+            file_size = await download()
+        return _file_result(file_size)
+
+    async def _mkdir_p_exec(self, sftp, remote_dirs):
+        """Create remote directories with 'mkdir -p'; False means fall back to SFTP"""
+        if self._exec_mkdir_ok is False:
+            return False
+        for command in _mkdir_p_commands(remote_dirs):
+            try:
+                result = await self._run_command(command, MKDIR_EXEC_TIMEOUT)
+            except Exception as e:
+                logger.info("mkdir -p over exec failed, using SFTP: %s", e)
+                self._exec_mkdir_ok = False
+                return False
+            if result['exit_status'] != 0:
+                return False
+        if self._exec_mkdir_ok is None:
+            # A ForceCommand internal-sftp account runs sftp-server instead,
+            # which can exit 0 without creating anything
+            if not await sftp.isdir(_deepest_dir(remote_dirs)):
+                logger.info("mkdir -p over exec did not create directories, using SFTP")
+                self._exec_mkdir_ok = False
+                return False
+            self._exec_mkdir_ok = True
+        return True
+
+    async def put_dir(self, local_dir, remote_dir, callback=None):
+        """
+        Upload a directory recursively to remote server.
+
+        Args:
+            local_dir: Local directory path
+            remote_dir: Remote destination directory
+            callback: Optional progress callback(current_file, bytes_transferred, total_bytes)
+
+        Returns:
+            dict: {'success': bool, 'error': str or None,
+                   'files_transferred': int, 'total_bytes': int, 'failed_files': list}
+        """
+        local_dir = os.path.expanduser(local_dir)
+        if not os.path.isdir(local_dir):
+            raise NotADirectoryError(f"Local directory not found: {local_dir}")
+
+        sftp = await self.get_sftp()
+        remote_base, subdir_groups, jobs, failed_files = _plan_upload(local_dir, remote_dir)
+
+        # One 'mkdir -p' creates the whole tree in a single round trip;
+        # accounts without a shell fall back to SFTP mkdirs, a level at a time
+        remote_dirs = [remote_base] + [d for group in subdir_groups for d in group]
+        if not await self._mkdir_p_exec(sftp, remote_dirs):
+            try:
+                await sftp.makedirs(remote_base, exist_ok=True)
+            except Exception as e:
+                return _dir_result(error=f"Failed to create remote directory: {e}")
+
+            async def mkdir(remote_subdir):
+                try:
+                    await sftp.mkdir(remote_subdir)
+                except asyncssh.SFTPError:
+                    # Most likely already there; a real failure shows up in its files
+                    pass
+
+            for group in subdir_groups:
+                await asyncio.gather(*(mkdir(d) for d in group))
+
+        files_transferred, total_bytes, errors = await self._transfer_files(jobs, sftp.put, callback)
+        return _dir_result(files_transferred, total_bytes, failed_files + errors)
+
+    async def get_dir(self, remote_dir, local_dir, callback=None):
+        """
+        Download a directory recursively from remote server.
+
+        Args:
+            remote_dir: Remote directory path
+            local_dir: Local destination directory
+            callback: Optional progress callback(current_file, bytes_transferred, total_bytes)
+
+        Returns:
+            dict: {'success': bool, 'error': str or None,
+                   'files_transferred': int, 'total_bytes': int, 'failed_files': list}
+        """
+        local_dir = os.path.expanduser(local_dir)
+        sftp = await self.get_sftp()
+
+        try:
+            remote_stat = await sftp.stat(remote_dir)
+            if not stat.S_ISDIR(remote_stat.permissions or 0):
+                return _dir_result(error=f"Remote path is not a directory: {remote_dir}")
+        except asyncssh.SFTPError:
+            return _dir_result(error=f"Remote directory not found: {remote_dir}")
+
+        async def list_dir(remote_path):
+            try:
+                entries = []
+                for entry in await sftp.readdir(remote_path):
+                    # Listings describe symlinks themselves; size and walk
+                    # them as what they point to
+                    mode, size, link_target = entry.attrs.permissions, entry.attrs.size, None
+                    if stat.S_ISLNK(mode or 0):
+                        link_path = f"{remote_path.rstrip('/')}/{entry.filename}"
+                        try:
+                            target = await sftp.stat(link_path)
+                            mode, size = target.permissions, target.size
+                            if stat.S_ISDIR(mode or 0):
+                                link_target = await sftp.realpath(link_path)
+                        except asyncssh.SFTPError:
+                            # Dangling: its download reports the error
+                            pass
+                    entries.append((entry.filename, mode, size, link_target))
+                return entries, None
+            except asyncssh.SFTPError as e:
+                # One unreadable directory shouldn't abort the whole walk
+                return [], {'file': remote_path, 'error': str(e)}
+
+        # List the tree a level at a time, reading each level's directories concurrently
+        local_dirs = [local_dir]
+        jobs = []
+        failed_files = []
+        level = [(remote_dir, local_dir, (await sftp.realpath(remote_dir),))]
+        while level:
+            listings = await asyncio.gather(*(list_dir(remote_path) for remote_path, _, _ in level))
+            next_level = []
+            for (remote_path, local_path, ancestors), (entries, err) in zip(level, listings):
+                if err is not None:
+                    failed_files.append(err)
+                subdirs, files = _split_listing(remote_path, local_path, ancestors, entries)
+                local_dirs.extend(local_entry for _, local_entry, _ in subdirs)
+                next_level.extend(subdirs)
+                jobs.extend(files)
+            level = next_level
+
+        for d in local_dirs:
+            os.makedirs(d, exist_ok=True)
+
+        files_transferred, total_bytes, errors = await self._transfer_files(jobs, sftp.get, callback)
+        return _dir_result(files_transferred, total_bytes, failed_files + errors)
+
+    async def close(self):
+        """Close connections"""
+        if self.sftp:
+            self.sftp.exit()
+            self.sftp = None
+        if self.conn:
+            self.conn.close()
+            await self.conn.wait_closed()
+            self.conn = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class _SFTPStat:
+    """The slice of paramiko's SFTPClient that callers use through get_sftp()"""
+
+    def __init__(self, ssh):
+        self._ssh = ssh
+
+    def stat(self, path):
+        async def remote_stat():
+            sftp = await self._ssh._async.get_sftp()
+            return await sftp.stat(path)
+
+        try:
+            attrs = self._ssh._run(remote_stat())
+        except asyncssh.SFTPError as e:
+            raise IOError(str(e)) from e
+        return types.SimpleNamespace(st_mode=attrs.permissions, st_size=attrs.size,
+                                     st_mtime=attrs.mtime)
+
+
+class PersistentSSH:
+    """Blocking drop-in for ssh_util.PersistentSSH backed by AsyncPersistentSSH"""
+
+    def __init__(self, hostname, username, password=None, key_filename=None, port=22,
+                 look_for_keys=False, allow_agent=False, compress=False):
+        self._async = AsyncPersistentSSH(hostname, username, password, key_filename, port,
+                                         look_for_keys, allow_agent, compress)
+        self.hostname = hostname
+        self.username = username
+        # One loop for the object's lifetime, so the connection outlives each call
+        self._runner = asyncio.Runner()
+        try:
+            self._run(self._async.connect())
+        except Exception:
+            self._runner.close()
+            raise
+
+    def _run(self, coro):
+        return self._runner.run(coro)
+
+    def connect(self):
+        self._run(self._async.connect())
+
+    def is_connected(self):
+        return self._run(self._async.is_connected())
+
+    def reconnect(self):
+        self._run(self._async.reconnect())
+
+    def execute(self, command, timeout=30, decode=True):
+        return self._run(self._async.execute(command, timeout, decode))
+
+    def get_sftp(self):
+        return _SFTPStat(self)
+
+    def put(self, local_path, remote_path, callback=None):
+        return self._run(self._async.put(local_path, remote_path, callback))
+
+    def get(self, remote_path, local_path, callback=None):
+        return self._run(self._async.get(remote_path, local_path, callback))
+
+    def put_dir(self, local_dir, remote_dir, callback=None):
+        return self._run(self._async.put_dir(local_dir, remote_dir, callback))
+
+    def get_dir(self, remote_dir, local_dir, callback=None):
+        return self._run(self._async.get_dir(remote_dir, local_dir, callback))
+
+    def close(self):
+        """Close connections"""
+        if self._runner is None:
+            return
+        try:
+            self._run(self._async.close())
+        finally:
+            self._runner.close()
+            self._runner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -5,34 +5,42 @@ Usage: python vps_cmd.py "command to run"
 """
 import os
 import sys
-from dotenv import load_dotenv
-from ssh_util import PersistentSSH
+from vps_config import get_ssh_params
 
 # Load credentials
-load_dotenv()
-login = os.getenv('login')
-password = os.getenv('password')
-key_file = os.getenv('SSH_KEY_FILE')
-key_filename = None
-if key_file:
-    key_path = os.path.join('keys', key_file)
-    if os.path.exists(key_path):
-        key_filename = key_path
-    else:
-        print(f"Error: SSH key file '{key_path}' not found.", file=sys.stderr)
+hostname, username, password, key_filename, port = get_ssh_params()
+
+# Reuse the long-lived connection held by vps_cmd_daemon.py when enabled
+if os.getenv('VPS_CMD_DAEMON', '').lower() in ('1', 'true', 'yes') and len(sys.argv) > 1:
+    from vps_cmd_daemon import DaemonUnavailable, run_command
+
+    try:
+        result = run_command(' '.join(sys.argv[1:]), timeout=300)
+    except DaemonUnavailable as e:
+        print(f"Warning: {e}; connecting directly", file=sys.stderr)
+    except RuntimeError as e:
+        # The command may have run already, so don't run it a second time
+        print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
-if not login or (password is None and key_filename is None):
-    print("Error: 'login' must be set, and either 'password' or 'SSH_KEY_FILE' (pointing to existing file in keys/) must be set in .env file", file=sys.stderr)
-    sys.exit(1)
-username, hostname = login.split('@', 1)
+    else:
+        sys.stdout.buffer.write(result['output'])
+        sys.stdout.flush()
+        sys.stderr.buffer.write(result['error'])
+        sys.stderr.flush()
+        sys.exit(result['exit_status'])
 
 # Connect
+if os.getenv('SSH_BACKEND') == 'asyncssh':
+    from ssh_util_async import PersistentSSH
+else:
+    from ssh_util import PersistentSSH
+
 ssh_conn = PersistentSSH(
     hostname=hostname,
     username=username,
     password=password,
     key_filename=key_filename,
-    port=22
+    port=port
 )
 
 try:
@@ -44,13 +52,15 @@ try:
     command = ' '.join(sys.argv[1:])
 
     # Execute
-    result = ssh_conn.execute(command, timeout=300)
+    result = ssh_conn.execute(command, timeout=300, decode=False)
 
-    # Output results
+    # Output results, passing the remote bytes through undecoded
     if result['output']:
-        print(result['output'], end='')
+        sys.stdout.buffer.write(result['output'])
+        sys.stdout.flush()
     if result['error']:
-        print(result['error'], file=sys.stderr, end='')
+        sys.stderr.buffer.write(result['error'])
+        sys.stderr.flush()
 
     sys.exit(result['exit_status'])
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Connection-sharing daemon for vps_cmd.py.
+
+The first command starts a background process that holds one PersistentSSH
+connection and serves commands over a Unix socket; later commands reuse it
+instead of paying for a new SSH handshake each time. The daemon exits after
+IDLE_TIMEOUT seconds without requests.
+
+Usage:
+  python vps_cmd_daemon.py "command"   # run via the daemon, starting it if needed
+  python vps_cmd_daemon.py --daemon    # run the daemon in the foreground
+  python vps_cmd_daemon.py --stop      # stop a running daemon
+Set VPS_CMD_DAEMON=1 in .env to make vps_cmd.py go through the daemon.
+"""
+import base64
+import errno
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from vps_config import get_ssh_params
+
+# Named explicitly: when run as a script, __name__ is '__main__'
+logger = logging.getLogger('vps_cmd_daemon')
+
+# Seconds without requests before the daemon closes the connection and exits
+IDLE_TIMEOUT = 10 * 60
+# Seconds to wait for a freshly started daemon to connect and listen
+START_TIMEOUT = 30
+# While a command runs the daemon sends a blank line this often, so clients
+# can time out on a dead daemon without limiting how long commands take
+HEARTBEAT_INTERVAL = 10
+REPLY_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+class DaemonUnavailable(RuntimeError):
+    """No daemon could be reached, so the command was not sent"""
+
+
+def _socket_path():
+    """Unix socket of the daemon for the configured user, host and port"""
+    hostname, username, password, key_filename, port = get_ssh_params()
+    # One daemon per target, so a .env change or another checkout never
+    # reuses a daemon connected somewhere else
+    target = hashlib.sha256(f"{username}@{hostname}:{port}".encode()).hexdigest()[:12]
+    return os.path.expanduser(f'~/.vps_cmd-{target}.sock')
+
+
+def _get_ssh():
+    from ssh_util import PersistentSSH
+
+    hostname, username, password, key_filename, port = get_ssh_params()
+    return PersistentSSH(
+        hostname=hostname,
+        username=username,
+        password=password,
+        key_filename=key_filename,
+        port=port
+    )
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.activity_lock:
+            server.active += 1
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get('stop'):
+                threading.Thread(target=server.shutdown, daemon=True).start()
+                return
+            done = threading.Event()
+            outcome = {}
+
+            def run():
+                try:
+                    outcome['result'] = server.ssh.execute(request['command'], timeout=request.get('timeout', 300), decode=False)
+                except Exception as e:
+                    outcome['result'] = {
+                        'output': b'',
+                        'error': f"vps_cmd_daemon: {e}\n".encode(),
+                        'exit_status': 255
+                    }
+                finally:
+                    done.set()
+
+            threading.Thread(target=run, daemon=True).start()
+            while not done.wait(HEARTBEAT_INTERVAL):
+                self.wfile.write(b'\n')
+            result = outcome['result']
+            reply = {
+                'output': base64.b64encode(result['output']).decode('ascii'),
+                'error': base64.b64encode(result['error']).decode('ascii'),
+                'exit_status': result['exit_status']
+            }
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+        finally:
+            with server.activity_lock:
+                server.active -= 1
+                server.last_activity = time.monotonic()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, ssh):
+        self.ssh = ssh
+        self.active = 0
+        self.last_activity = time.monotonic()
+        self.activity_lock = threading.Lock()
+        # Anyone who can connect can run remote commands: owner-only socket
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def watch_idle(self):
+        while True:
+            time.sleep(5)
+            with self.activity_lock:
+                idle = self.active == 0 and time.monotonic() - self.last_activity > IDLE_TIMEOUT
+            if idle:
+                logger.info("Idle for %ds, exiting", IDLE_TIMEOUT)
+                self.shutdown()
+                return
+
+
+def _connect():
+    """Connect to a running daemon, or return None if there isn't one"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(REPLY_TIMEOUT)
+    try:
+        sock.connect(_socket_path())
+        return sock
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+
+def serve():
+    """Hold one SSH connection and serve commands until idle or stopped"""
+    socket_path = _socket_path()
+    # Exiting 0 when another daemon owns the socket tells the client that
+    # started us to keep connecting rather than give up
+    existing = _connect()
+    if existing is not None:
+        existing.close()
+        print(f"A daemon is already listening on {socket_path}", file=sys.stderr)
+        return
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    ssh = _get_ssh()
+    try:
+        server = _Server(socket_path, ssh)
+    except OSError as e:
+        ssh.close()
+        if e.errno != errno.EADDRINUSE:
+            raise
+        # Lost a race with another daemon starting at the same time
+        logger.info("Another daemon bound %s first, exiting", socket_path)
+        return
+    threading.Thread(target=server.watch_idle, daemon=True).start()
+    logger.info("Listening on %s", socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        ssh.close()
+
+
+def _start_daemon():
+    """Start the daemon in the background and wait until it accepts connections"""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--daemon'],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        sock = _connect()
+        if sock is not None:
+            return sock
+        # Status 0 means another daemon won the race to start; wait for it
+        if proc.poll() is not None and proc.returncode != 0:
+            raise DaemonUnavailable(f"vps_cmd daemon exited with status {proc.returncode}; run 'python vps_cmd_daemon.py --daemon' to see why")
+        time.sleep(0.1)
+    raise DaemonUnavailable(f"vps_cmd daemon did not start listening within {START_TIMEOUT}s")
+
+
+def run_command(command, timeout=300):
+    """
+    Run a command through the daemon, starting the daemon if needed.
+
+    Returns:
+        dict: {'output': bytes, 'error': bytes, 'exit_status': int}
+
+    Raises:
+        DaemonUnavailable: If no daemon could be reached or started; the
+            command was not sent, so it is safe to run it another way
+        RuntimeError: If the daemon stops responding or closes the connection
+            without a valid reply; the command may already have run
+    """
+    try:
+        sock = _connect()
+        if sock is None:
+            sock = _start_daemon()
+    except OSError as e:
+        raise DaemonUnavailable(f"Can't reach vps_cmd daemon: {e}") from e
+    with sock:
+        try:
+            sock.sendall(json.dumps({'command': command, 'timeout': timeout}).encode() + b'\n')
+            reader = sock.makefile('rb')
+            line = reader.readline()
+            # Blank lines are heartbeats from a daemon still running the command
+            while line == b'\n':
+                line = reader.readline()
+        except OSError as e:
+            raise RuntimeError(f"Lost contact with vps_cmd daemon: {e}") from e
+    if not line:
+        raise RuntimeError("vps_cmd daemon closed the connection without replying")
+    try:
+        reply = json.loads(line)
+        return {
+            'output': base64.b64decode(reply['output']),
+            'error': base64.b64decode(reply['error']),
+            'exit_status': reply['exit_status']
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise RuntimeError(f"Invalid reply from vps_cmd daemon: {e}") from e
+
+
+def stop():
+    """Ask a running daemon to exit"""
+    sock = _connect()
+    if sock is None:
+        return False
+    with sock:
+        sock.sendall(json.dumps({'stop': True}).encode() + b'\n')
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python vps_cmd_daemon.py 'command' | --daemon | --stop", file=sys.stderr)
+        sys.exit(1)
+
+    if sys.argv[1] == '--daemon':
+        logging.basicConfig(level=logging.WARNING, format='%(message)s', stream=sys.stderr)
+        for name in ('ssh_util', 'vps_cmd_daemon'):
+            logging.getLogger(name).setLevel(logging.INFO)
+        serve()
+    elif sys.argv[1] == '--stop':
+        if not stop():
+            print("No vps_cmd daemon is running.", file=sys.stderr)
+            sys.exit(1)
+    else:
+        try:
+            result = run_command(' '.join(sys.argv[1:]))
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.buffer.write(result['output'])
+        sys.stdout.flush()
+        sys.stderr.buffer.write(result['error'])
+        sys.stderr.flush()
+        sys.exit(result['exit_status'])
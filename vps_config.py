@@ -0,0 +1,40 @@
+"""
+Connection settings shared by the VPS scripts, read from .env once per process.
+"""
+import functools
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ENV_PATH = Path(__file__).with_name('.env')
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssh_params():
+    """
+    Parse the connection settings from .env, exiting with an error if unusable.
+
+    Returns:
+        tuple: (hostname, username, password, key_filename, port)
+    """
+    # An explicit path skips find_dotenv()'s search up the directory tree
+    load_dotenv(dotenv_path=ENV_PATH)
+    login = os.getenv('login')
+    password = os.getenv('password')
+    key_file = os.getenv('SSH_KEY_FILE')
+    key_filename = None
+    if key_file:
+        key_path = os.path.join('keys', key_file)
+        if os.path.exists(key_path):
+            key_filename = key_path
+        else:
+            print(f"Error: SSH key file '{key_path}' not found.", file=sys.stderr)
+            sys.exit(1)
+    if not login or '@' not in login or (password is None and key_filename is None):
+        print("Error: 'login' (username@host) must be set, and either 'password' or 'SSH_KEY_FILE' (pointing to existing file in keys/) must be set in .env file", file=sys.stderr)
+        sys.exit(1)
+    username, hostname = login.split('@', 1)
+    port = int(os.getenv('SSH_PORT', 22))
+    return hostname, username, password, key_filename, port
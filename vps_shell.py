@@ -5,9 +5,17 @@ import select
 import signal
 import struct
 import termios
+import time
 import tty
-from dotenv import load_dotenv
 from ssh_util import PersistentSSH
+from vps_config import get_ssh_params
+
+
+# Read bulk shell output in large chunks to cut per-call overhead
+SHELL_RECV_SIZE = 256 * 1024
+# Flush buffered shell output at most every 16ms, or once 64 KiB is pending
+SHELL_FLUSH_INTERVAL = 0.016
+SHELL_FLUSH_BYTES = 64 * 1024
 
 
 def _get_terminal_size():
@@ -23,6 +31,13 @@ def _get_terminal_size():
         return 80, 24
 
 
+def _write_all(fd, data):
+    """Write all of data to fd, retrying after partial writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
 def interactive_shell(ssh_conn):
     """Open an interactive shell session with full raw terminal support."""
     cols, rows = _get_terminal_size()
@@ -42,29 +57,59 @@ def interactive_shell(ssh_conn):
 
     try:
         tty.setraw(sys.stdin.fileno())
-        tty.setcbreak(sys.stdin.fileno())
         channel.settimeout(0.0)
         signal.signal(signal.SIGWINCH, sigwinch_handler)
 
-        while True:
-            r, w, e = select.select([channel, sys.stdin], [], [])
+        stdin_fd = sys.stdin.fileno()
+        channel_fd = channel.fileno()
+        poller = select.poll()
+        poller.register(channel_fd, select.POLLIN)
+        poller.register(stdin_fd, select.POLLIN)
 
-            if channel in r:
+        # Write output straight to the fd, skipping sys.stdout's buffer layers
+        sys.stdout.flush()
+        out_fd = sys.stdout.fileno()
+        pending = bytearray()
+        last_flush = 0.0
+
+        while True:
+            if pending:
+                # Wake up in time to flush whatever is still buffered
+                remaining = last_flush + SHELL_FLUSH_INTERVAL - time.monotonic()
+                events = poller.poll(max(remaining, 0) * 1000)
+            else:
+                events = poller.poll()
+            ready = {fd for fd, _ in events}
+
+            if channel_fd in ready:
                 try:
-                    data = channel.recv(4096)
+                    data = channel.recv(SHELL_RECV_SIZE)
                     if len(data) == 0:
                         break
-                    sys.stdout.buffer.write(data)
-                    sys.stdout.buffer.flush()
+                    pending += data
+                    # Drain whatever is already buffered before polling again
+                    while channel.recv_ready() and len(pending) < SHELL_FLUSH_BYTES:
+                        pending += channel.recv(SHELL_RECV_SIZE)
                 except Exception:
                     break
 
-            if sys.stdin in r:
-                data = os.read(sys.stdin.fileno(), 1024)
+            # Batch output so chatty commands don't starve keyboard input
+            now = time.monotonic()
+            if pending and (len(pending) >= SHELL_FLUSH_BYTES
+                            or now - last_flush >= SHELL_FLUSH_INTERVAL):
+                _write_all(out_fd, pending)
+                pending.clear()
+                last_flush = now
+
+            if stdin_fd in ready:
+                data = os.read(stdin_fd, 4096)
                 if len(data) == 0:
                     break
                 channel.send(data)
 
+        if pending:
+            _write_all(out_fd, pending)
+
     finally:
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
         signal.signal(signal.SIGWINCH, old_sigwinch)
@@ -72,33 +117,20 @@ def interactive_shell(ssh_conn):
 
 def execute_command(ssh_conn, command):
     """Execute a single command and return results"""
-    result = ssh_conn.execute(command)
+    result = ssh_conn.execute(command, decode=False)
 
     if result['output']:
-        print(result['output'], end='')
+        sys.stdout.buffer.write(result['output'])
+        sys.stdout.flush()
     if result['error']:
-        print(result['error'], file=sys.stderr, end='')
+        sys.stderr.buffer.write(result['error'])
+        sys.stderr.flush()
 
     return result['exit_status']
 
 if __name__ == "__main__":
     # Load credentials
-    load_dotenv()
-    login = os.getenv('login')
-    password = os.getenv('password')
-    key_file = os.getenv('SSH_KEY_FILE')
-    key_filename = None
-    if key_file:
-        key_path = os.path.join('keys', key_file)
-        if os.path.exists(key_path):
-            key_filename = key_path
-        else:
-            print(f"Error: SSH key file '{key_path}' not found.", file=sys.stderr)
-            sys.exit(1)
-    if not login or (password is None and key_filename is None):
-        print("Error: 'login' must be set, and either 'password' or 'SSH_KEY_FILE' (pointing to existing file in keys/) must be set in .env file", file=sys.stderr)
-        sys.exit(1)
-    username, hostname = login.split('@', 1)
+    hostname, username, password, key_filename, port = get_ssh_params()
 
     # Connect
     ssh_conn = PersistentSSH(
@@ -106,7 +138,7 @@ if __name__ == "__main__":
         username=username,
         password=password,
         key_filename=key_filename,
-        port=22
+        port=port
     )
 
     try: